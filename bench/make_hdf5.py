@@ -0,0 +1,46 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+# 生成与生产数据结构相近的 store.hdf5 /ods/db/<库>/<表> 形式的键 每张表混合整数、浮点、字符串、时间和布尔列
+def make_frame(rows, columns, rng, start=0):
+    data = {'id': np.arange(start, start + rows, dtype=np.int64)}
+    for i in range(columns - 1):
+        kind = i % 5
+        if kind == 0:
+            data[f'qty_{i}'] = rng.integers(0, 100000, rows)
+        elif kind == 1:
+            values = rng.random(rows) * 1000
+            values[rng.random(rows) < 0.01] = np.nan  # 少量空值
+            data[f'weight_{i}'] = values
+        elif kind == 2:
+            data[f'code_{i}'] = pd.Series(rng.integers(0, 5000, rows)).map('M{:06d}'.format).to_numpy(dtype=object)
+        elif kind == 3:
+            data[f'time_{i}'] = pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 365 * 86400, rows), unit='s')
+        else:
+            data[f'flag_{i}'] = rng.random(rows) < 0.5
+    return pd.DataFrame(data)
+
+def make_store(path, tables=4, rows=100000, columns=10, seed=0, chunk_rows=500000):  # 返回 {键: 行数}
+    rng = np.random.default_rng(seed)
+    keys = {}
+    with pd.HDFStore(path, 'w') as store:
+        for t in range(tables):
+            key = f'/ods/db/bench/table_{t}'
+            for start in range(0, rows, chunk_rows):
+                # 分块追加 生成大文件时内存不随行数增长
+                df = make_frame(min(chunk_rows, rows - start), columns, rng, start)
+                store.append(key, df, format='table', min_itemsize={c: 16 for c in df.columns if df[c].dtype == object})
+            keys[key] = rows
+    return keys
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic store.hdf5')
+    parser.add_argument('path')
+    parser.add_argument('--tables', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    print(make_store(args.path, args.tables, args.rows, args.columns, args.seed))
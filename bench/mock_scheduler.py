@@ -0,0 +1,105 @@
+import argparse
+import math
+import threading
+import time
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server
+
+# 本地模拟调度程序接口 用于在没有真实 TEST_ADDRESS 的环境下压测本服务
+# latency: 每次接口调用的固定延迟(秒); schedule_seconds: 排程从开始到进度100的耗时(秒)
+# curve: 进度曲线 linear 匀速; sigmoid 两头慢中间快; stall 前80%时间停在10 之后跳到100
+# result_size: getScheduledJobs 返回的任务条数
+CURVES = {
+    'linear': lambda x: x,
+    'sigmoid': lambda x: 1 / (1 + math.exp(-12 * (x - 0.5))),
+    'stall': lambda x: 0.1 if x < 0.8 else 1,
+}
+
+def create_mock_app(latency=0.0, schedule_seconds=5.0, curve='linear', result_size=100):
+    mock = Flask('mock_scheduler')
+    lock = threading.Lock()
+    mock.state = {'plans': {}, 'calls': {}, 'messages': []}
+    progress_of = CURVES[curve]
+
+    def reply(**data):
+        if latency:
+            time.sleep(latency)
+        return jsonify(code=0, message='success', **data)
+
+    def count(name):
+        with lock:
+            mock.state['calls'][name] = mock.state['calls'].get(name, 0) + 1
+
+    def progress(plan):
+        if plan['started'] is None:
+            return 0
+        ratio = min((time.time() - plan['started']) / schedule_seconds, 1) if schedule_seconds > 0 else 1
+        return 100 if ratio >= 1 else min(int(progress_of(ratio) * 100), 99)
+
+    def find_plan(plan_type):
+        return mock.state['plans'].get((request.get_json(force=True) or {}).get(plan_type + 'Id'))
+
+    @mock.route('/<plan_type>/new<kind>', methods=['POST'])
+    def new_plan(plan_type, kind):
+        count('new' + kind)
+        data = request.get_json(force=True) or {}
+        with lock:
+            plan_id = len(mock.state['plans']) + 1
+            mock.state['plans'][plan_id] = {'type': plan_type, 'station': data.get('station'), 'started': None}
+        return reply(data={plan_type + 'Id': plan_id})
+
+    @mock.route('/<plan_type>/schedule', methods=['POST'])
+    def schedule(plan_type):
+        count('schedule')
+        plan = find_plan(plan_type)
+        if plan is None:
+            return jsonify(code=1, message='plan not found')
+        plan['started'] = time.time()
+        return reply()
+
+    @mock.route('/<plan_type>/getScheduleStatus', methods=['POST'])
+    def get_schedule_status(plan_type):
+        count('getScheduleStatus')
+        plan = find_plan(plan_type)
+        if plan is None:
+            return jsonify(code=1, message='plan not found')
+        return reply(data={'progress': progress(plan)})
+
+    @mock.route('/<plan_type>/getScheduledJobs', methods=['POST'])
+    def get_scheduled_jobs(plan_type):
+        count('getScheduledJobs')
+        return reply(data=[{'jobNo': i} for i in range(result_size)])
+
+    @mock.route('/<plan_type>/getAll<kind>', methods=['POST'])
+    def get_all_plans(plan_type, kind):
+        count('getAll' + kind)
+        data = request.get_json(force=True) or {}
+        # 只返回计算中的计划 作业计划按 jobType(产线) 区分
+        busy = [plan_id for plan_id, plan in list(mock.state['plans'].items())
+                if plan['type'] == plan_type and 0 < progress(plan) < 100
+                and (plan_type != 'jobPlan' or plan['station'] == data.get('jobType'))]
+        return reply(data={'total': len(busy), 'jobPlans': busy, 'orderPlans': busy})
+
+    @mock.route('/qyapi', methods=['POST'])
+    def qyapi():  # 企业微信机器人消息
+        count('qyapi')
+        mock.state['messages'].append(request.get_json(force=True))
+        return jsonify(errcode=0, errmsg='ok')
+
+    return mock
+
+def start_mock_server(mock, host='127.0.0.1', port=0):  # 在后台线程中启动 port 为0时随机端口 返回(服务器, 地址)
+    server = make_server(host, port, mock, threaded=True)
+    threading.Thread(target=server.serve_forever, name='mock-scheduler', daemon=True).start()
+    return server, f'http://{host}:{server.server_port}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Mock SLIPS scheduler API')
+    parser.add_argument('--port', type=int, default=60010)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--schedule-seconds', type=float, default=5.0)
+    parser.add_argument('--curve', choices=sorted(CURVES), default='linear')
+    parser.add_argument('--result-size', type=int, default=100)
+    args = parser.parse_args()
+    create_mock_app(args.latency, args.schedule_seconds, args.curve, args.result_size).run(host='0.0.0.0', port=args.port, threaded=True)
@@ -0,0 +1,270 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, BENCH_DIR)
+
+from make_hdf5 import make_store
+from mock_scheduler import create_mock_app, start_mock_server
+
+# 本服务自身的基准测试 不依赖真实调度程序和 MySQL:
+# 调度接口由 mock_scheduler 模拟 数据库默认使用临时目录下的 SQLite 结果写入 JSON 便于长期跟踪
+# 用法: python3 bench/run_bench.py [--only import,upload,runs] [--db mysql+pymysql://...] [--out result.json]
+BENCHMARKS = ('import', 'upload', 'runs')
+
+def setup_service(args, work_dir, address):  # 在导入 slips_data_svc 之前改写配置 所有路径都放在临时目录下
+    import config
+    cfg = config.Config
+    cfg.SQLALCHEMY_DATABASE_URI = args.db or 'sqlite:///' + os.path.join(work_dir, 'bench.sqlite') + '?timeout=300'  # 并行导入的写入排队等锁 不报 database is locked
+    cfg.UPLOAD_FOLDER = os.path.join(work_dir, 'uploads')
+    cfg.STORAGE_PATH = os.path.join(work_dir, 'history')
+    cfg.EXECUTE_PATH = os.path.join(work_dir, 'data')
+    cfg.EXECUTE_SLOT_PATH = os.path.join(work_dir, 'data', '.slots')
+    cfg.BLOB_PATH = os.path.join(work_dir, 'blobs')
+    cfg.TEST_ADDRESS = address
+    cfg.QYAPI = address + '/qyapi'
+    cfg.POLL_INTERVAL_MIN = args.poll_interval
+    cfg.WATCH_INTERVAL = args.poll_interval
+    cfg.RUN_CLAIM_INTERVAL = args.poll_interval
+    cfg.NOTIFY_WINDOW = args.poll_interval
+    cfg.RUN_QUEUE_LIMIT = max(cfg.RUN_QUEUE_LIMIT, args.runs_per_type)
+    if args.import_workers is not None:
+        cfg.IMPORT_WORKERS = args.import_workers
+    cfg.COLUMNAR_CACHE = args.columnar
+    if args.chunk_size is not None:
+        cfg.IMPORT_CHUNK_SIZE = args.chunk_size
+    os.chdir(work_dir)  # app.log 写在临时目录
+    import slips_data_svc
+    return slips_data_svc
+
+def current_rss():  # 当前进程常驻内存字节数 没有 /proc 时退回历史峰值
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def measure(func, *args):  # 返回(结果, 耗时秒, 内存指标)
+    # 不用 tracemalloc: 它跟踪每次分配 导入会慢 3-4 倍 耗时和吞吐量就不真实了 内存改为后台线程采样 RSS
+    baseline = current_rss()
+    samples = [baseline]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(0.05):
+            samples.append(current_rss())
+
+    sampler = threading.Thread(target=sample, name='rss-sampler', daemon=True)
+    sampler.start()
+    start_time = time.time()
+    try:
+        result = func(*args)
+        seconds = time.time() - start_time
+    finally:
+        done.set()
+        sampler.join()
+    samples.append(current_rss())
+    memory = {
+        'rss_peak_bytes': max(samples),
+        'rss_growth_bytes': max(samples) - baseline,  # 调用期间相对开始时的 RSS 峰值增长
+        'max_rss_bytes': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        'children_max_rss_bytes': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024,  # 子进程导入时
+    }
+    return result, seconds, memory
+
+def bench_import(svc, args, work_dir):  # 首次全量导入和数据未变化时再次导入
+    path = os.path.join(work_dir, 'import.hdf5')
+    keys = make_store(path, args.tables, args.rows, args.columns)
+    results = {'file_bytes': os.path.getsize(path), 'tables': len(keys), 'rows': sum(keys.values())}
+    if args.columnar:
+        # 与上传时一样把文件硬链接进内容寻址存储并生成列式缓存 导入时按 inode 找到缓存
+        digest = svc.file_sha256(path)
+        os.makedirs(os.path.dirname(svc.blob_path(digest)), exist_ok=True)
+        os.link(path, svc.blob_path(digest))
+        _, seconds, memory = measure(svc.build_columnar_cache, digest)
+        results['columnar_build'] = {'seconds': seconds, **memory}
+    for label in ('full', 'unchanged'):
+        result, seconds, memory = measure(svc.import_data_to_db, path)
+        rows = sum(item['rows'] for item in result['tables'].values() if item['action'] != 'skip')
+        results[label] = {
+            'seconds': seconds,
+            'rows_written': rows,
+            'rows_per_second': rows / seconds if seconds > 0 else None,
+            'table_seconds': result['table_seconds'],
+            'workers': result['workers'],
+            'actions': {table: item['action'] for table, item in result['tables'].items()},
+            **memory,
+        }
+    return results
+
+def make_case_zip(path, work_dir, args):  # 每个用例文件夹一个 store.hdf5 和 algo_config.json
+    store = os.path.join(work_dir, 'upload.hdf5')
+    make_store(store, args.tables, args.upload_rows, args.columns, seed=1)
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for i in range(args.cases):
+            zip_ref.write(store, f'case_{i}/store.hdf5')
+            zip_ref.writestr(f'case_{i}/algo_config.json', json.dumps({'case': i}))
+    os.remove(store)
+
+def upload(svc, path):
+    with open(path, 'rb') as f:
+        res = svc.app.test_client().post('/upload/d1_plan/merge', data={'file': (f, 'cases.zip')}, content_type='multipart/form-data')
+    if res.status_code != 302:
+        raise RuntimeError(f'Upload failed with status {res.status_code}')
+
+def bench_upload(svc, args, work_dir):  # 首次上传和内容相同的再次上传(文件已在内容寻址存储中)
+    path = os.path.join(work_dir, 'cases.zip')
+    make_case_zip(path, work_dir, args)
+    with zipfile.ZipFile(path) as zip_ref:
+        extract_bytes = sum(info.file_size for info in zip_ref.infolist())
+    results = {'zip_bytes': os.path.getsize(path), 'extract_bytes': extract_bytes, 'cases': args.cases}
+    for label in ('first', 'repeat'):
+        _, seconds, memory = measure(upload, svc, path)
+        results[label] = {
+            'seconds': seconds,
+            'extract_bytes_per_second': extract_bytes / seconds if seconds > 0 else None,
+            **memory,
+        }
+    if len(os.listdir(os.path.join(svc.app.config['STORAGE_PATH'], 'd1_plan', 'merge'))) != args.cases:
+        raise RuntimeError('Uploaded cases were not extracted')
+    return results
+
+def prepare_run_cases(svc, args):  # 每个计划类型的 push 阶段放 run_cases 个小用例
+    for plan_type in svc.PLAN_TYPES:
+        for i in range(args.run_cases):
+            case_path = os.path.join(svc.app.config['STORAGE_PATH'], plan_type, 'push', f'case_{i}')
+            os.makedirs(case_path, exist_ok=True)
+            with open(os.path.join(case_path, 'algo_config.json'), 'w') as f:
+                json.dump({'case': i}, f)
+            make_store(os.path.join(case_path, 'store.hdf5'), 1, 100, 4, seed=i)
+
+def bench_runs(svc, mock, args):  # 各计划类型同时排队多次测试 统计吞吐量和每次运行的排队、执行耗时
+    prepare_run_cases(svc, args)
+    svc.get_run_loop()  # 在本进程中启动运行 worker
+    client = svc.app.test_client()
+    calls_before = dict(mock.state['calls'])
+    start_time = time.time()
+    run_ids = []
+    for i in range(args.runs_per_type):
+        for plan_type in svc.PLAN_TYPES:
+            res = client.post(f'/auto_execute_branch/{plan_type}', json={'imageName': f'bench:{i}'})
+            run_ids.append(res.get_json()['run_id'])
+    deadline = start_time + args.run_timeout
+    runs = []
+    while time.time() < deadline:
+        runs = [client.get(f'/runs/{run_id}').get_json() for run_id in run_ids]
+        if all(run['state'] in ('succeeded', 'failed') for run in runs):
+            break
+        time.sleep(0.2)
+    seconds = time.time() - start_time
+    finished = [run for run in runs if run['state'] in ('succeeded', 'failed')]
+    time.sleep(svc.app.config['NOTIFY_WINDOW'] + 1)  # 等待最后一批合并通知发出
+    calls = {name: count - calls_before.get(name, 0) for name, count in mock.state['calls'].items()}
+    notifications = calls.pop('qyapi', 0)
+    return {
+        'runs': len(run_ids),
+        'cases_per_run': args.run_cases,
+        'finished': len(finished),
+        'succeeded': sum(run['state'] == 'succeeded' for run in runs),
+        'seconds': seconds,
+        'runs_per_minute': len(finished) * 60 / seconds if seconds > 0 else None,
+        'queued_seconds': summarize([run['queued_seconds'] for run in finished]),
+        'run_seconds': summarize([run['run_seconds'] for run in finished]),
+        'scheduler_calls': calls,
+        'scheduler_calls_per_case': sum(calls.values()) / max(len(finished) * args.run_cases, 1),
+        'notifications': notifications,
+    }
+
+def summarize(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    return {'min': values[0], 'median': values[len(values) // 2], 'p90': values[int(len(values) * 0.9)], 'max': values[-1]}
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark slips-data-svc against a mock scheduler')
+    parser.add_argument('--only', default=','.join(BENCHMARKS), help='comma separated: ' + ','.join(BENCHMARKS))
+    parser.add_argument('--db', help='SQLAlchemy URI of the import target, default a throwaway SQLite file')
+    parser.add_argument('--out', help='result JSON path, default bench/results/<time>.json')
+    parser.add_argument('--work-dir', help='keep data in this directory instead of a temporary one')
+    parser.add_argument('--tables', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=200000, help='rows per table of the import benchmark')
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--chunk-size', type=int, help='override IMPORT_CHUNK_SIZE')
+    parser.add_argument('--import-workers', type=int, help='override IMPORT_WORKERS')
+    parser.add_argument('--columnar', action='store_true', help='enable COLUMNAR_CACHE and import from the Arrow cache')
+    parser.add_argument('--cases', type=int, default=8, help='case folders in the upload zip')
+    parser.add_argument('--upload-rows', type=int, default=50000, help='rows per table of each uploaded store.hdf5')
+    parser.add_argument('--runs-per-type', type=int, default=3)
+    parser.add_argument('--run-cases', type=int, default=2, help='cases per plan type of the run benchmark')
+    parser.add_argument('--run-timeout', type=float, default=600)
+    parser.add_argument('--latency', type=float, default=0.01, help='mock scheduler latency per call (s)')
+    parser.add_argument('--schedule-seconds', type=float, default=2.0, help='mock scheduler compute time per plan (s)')
+    parser.add_argument('--curve', default='linear', help='mock scheduler progress curve')
+    parser.add_argument('--result-size', type=int, default=100)
+    parser.add_argument('--poll-interval', type=float, default=0.2, help='POLL_INTERVAL_MIN and WATCH_INTERVAL (s)')
+    args = parser.parse_args()
+    selected = [name for name in args.only.split(',') if name]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmark(s): {", ".join(sorted(unknown))}')
+    out = os.path.abspath(args.out or os.path.join(BENCH_DIR, 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json'))
+
+    work_dir = os.path.abspath(args.work_dir) if args.work_dir else tempfile.mkdtemp(prefix='slips-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    mock = create_mock_app(args.latency, args.schedule_seconds, args.curve, args.result_size)
+    server, address = start_mock_server(mock)
+    report = {
+        'started_at': datetime.now().isoformat(),
+        'git_revision': git_revision(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'params': vars(args),
+        'results': {},
+    }
+    try:
+        svc = setup_service(args, work_dir, address)
+        report['target'] = svc.app.config['SQLALCHEMY_DATABASE_URI'].split('@')[-1]
+        # 服务中的 print 输出写到日志文件 不干扰结果
+        with open(os.path.join(work_dir, 'service.out'), 'a') as log, contextlib.redirect_stdout(log):
+            for name in selected:
+                if name == 'import':
+                    report['results'][name] = bench_import(svc, args, work_dir)
+                elif name == 'upload':
+                    report['results'][name] = bench_upload(svc, args, work_dir)
+                else:
+                    report['results'][name] = bench_runs(svc, mock, args)
+    finally:
+        server.shutdown()
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(report['results'], indent=2, ensure_ascii=False))
+    print(f'Results written to {out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -6,10 +6,54 @@ class Config:
     ALLOWED_EXTENSIONS = {'zip'}
     STORAGE_PATH = '/home/slips/data/config/history'
     EXECUTE_PATH = '/home/slips/data/config/data'
+    BLOB_PATH = '/home/slips/data/config/blobs'  # 上传文件按 sha256 存储的位置 与 STORAGE_PATH 在同一文件系统才能硬链接
+    EXECUTE_SLOT_PATH = EXECUTE_PATH + '/.slots'  # 每次运行独立的执行目录 EXECUTE_PATH/<计划类型>/<阶段> 为指向其中之一的符号链接
     TEST_ADDRESS='http://10.10.201.13:60010'
     QYAPI='https://qyapi.weixin.qq.com/cgi-bin/webhook/send?key=b5ca1682-c30e-4811-9e81-2cc80dcfc23e'
     ORDER_BRANCH='450-he-tong-ji-hua-gu-ding-fen-zhi'
     S1_BRANCH='451-s1-gu-ding-fen-zhi'
     D1_BRANCH='58-d1_zuo-ye-you-hua'
     D2_BRANCH='453-d2-zuo-ye-ji-hua'
-    T1_BRANCH='318-lian-tui-you-hua'
\ No newline at end of file
+    T1_BRANCH='318-lian-tui-you-hua'
+    IMPORT_CHUNK_SIZE=50000  # HDF5按行分块读取和写库的行数 峰值内存与之相关
+    IMPORT_LOAD_METHOD='executemany'  # executemany: 多行INSERT批量写入; infile: LOAD DATA LOCAL INFILE 暂存文件导入
+    IMPORT_WORKERS=4  # 并行导入的表数 设为1时退回逐表串行导入
+    IMPORT_WORKER_TYPE='thread'  # thread: 线程并行写库(HDF5读取串行); process: 子进程并行 HDF5 解码也并行
+    IMPORT_MODE='swap'  # swap: 导入 <表名>__staging 影子表后 RENAME 替换线上表; replace: 直接删表重建
+    IMPORT_TYPED_SCHEMA=True  # 按数据统计生成最窄的列类型(整数宽度、VARCHAR(n)、DATETIME) 关闭时沿用 pandas 推断的 BIGINT/DOUBLE/TEXT
+    IMPORT_VARCHAR_MAX=768  # 文本列最长值不超过该字符数时用 VARCHAR(n) 否则用 TEXT 768 为 utf8mb4 下可整列建索引的上限
+    IMPORT_SCHEMA_FILE='import_schema.json'  # 可选 各表的主键和索引 {表名: {"primary_key": [列名], "unique": [[列名, ...]], "indexes": [[列名, ...]]}} 导入完成后再建
+    COLUMNAR_CACHE=False  # 上传时把 HDF5 中每个 /ods/db 键转为 BLOB_PATH/columnar 下的 Arrow 文件 导入和预览时内存映射读取
+    IMPORT_INCREMENTAL=True  # 按 import_manifest 表中的指纹跳过未变化的表 只追加新增行的表
+    RUN_IO_WORKERS=16  # 测试事件循环中执行接口调用、文件复制等阻塞操作的线程数
+    POLL_INTERVAL_MIN=2  # 排程忙等和进度轮询的最短间隔(秒)
+    POLL_INTERVAL_MAX=60  # 轮询间隔退避上限(秒)
+    POLL_BACKOFF=1.5  # 没有新进展时轮询间隔的放大倍数
+    API_CONNECT_TIMEOUT=5  # 调度接口连接超时(秒)
+    API_READ_TIMEOUT=60  # 调度接口读取超时(秒)
+    API_RETRIES=3  # 调度接口瞬时错误的重试次数
+    API_RETRY_BACKOFF=0.5  # 重试退避基数(秒) 按 2^n 放大并加随机抖动
+    API_POOL_SIZE=16  # 调度接口连接池大小 与 RUN_IO_WORKERS 一致
+    RUN_WORKERS={'order_plan':1,'s1_plan':1,'d1_plan':1,'d2_plan':1,'t1_plan':1}  # 各计划类型同时执行的测试数 所有副本合计
+    RUN_LEASE_SECONDS=120  # 运行租约时长(秒) worker 每隔三分之一续租一次 过期未续租的运行由其他 worker 接管
+    RUN_CLAIM_INTERVAL=5  # 没有可执行的运行时 worker 再次查询的间隔(秒)
+    RUN_MAX_ATTEMPTS=2  # 一个运行最多被执行的次数 接管次数用完后记为失败
+    RUN_QUEUE_LIMIT=20  # 每种计划类型最多排队的测试数 超出时拒绝新请求
+    EXECUTE_LINK_MODE='hardlink'  # 用例文件放入执行目录的方式 hardlink/reflink/copy 调度程序会改写输入文件时需设为 reflink 或 copy
+    EXECUTE_SLOT_RETENTION=3  # 每个计划类型和阶段保留的最近运行目录数
+    UPLOAD_KEEP_ARCHIVE=False  # 是否在 UPLOAD_FOLDER 中保留上传的 zip 关闭时直接从接收的临时文件解压
+    UPLOAD_MAX_EXTRACT_BYTES=64*1024**3  # zip 解压后的总大小上限
+    UPLOAD_CHUNK_SIZE=64*1024**2  # 分块上传时建议客户端使用的块大小
+    UPLOAD_SESSION_TTL=24*3600  # 分块上传超过该时间(秒)没有新块时删除
+    WATCH_INTERVAL=5  # 有运行在等待时 每个产线查询调度程序是否空闲的间隔(秒)
+    WATCH_TTL=3  # 空闲状态的缓存有效期(秒) 超过后需重新查询才能放行
+    RUN_PREFETCH_DEPTH=1  # 当前用例排程期间提前准备的后续用例数 0 表示逐个准备
+    PERF_BASELINE_RUNS=10  # 性能基线取同产线同数据集最近几次成功排程的中位数
+    PERF_BASELINE_MIN_RUNS=3  # 基线样本少于该数时不做对比
+    PERF_REGRESSION_THRESHOLD=0.2  # 计算耗时超过基线该比例时标记为性能下降
+    NOTIFY_WINDOW=10  # 同一产线和分支的测试结果在该时间(秒)内合并为一条企业微信消息
+    NOTIFY_RATE_PER_MINUTE=18  # 所有副本合计每分钟最多发送的消息数 企业微信机器人上限为20条/分钟 发送时间记在 notify_rate 表中
+    NOTIFY_BURST=5  # 令牌桶容量 空闲后最多连续发送的消息数
+    NOTIFY_RETRIES=3  # 发送失败的重试次数
+    NOTIFY_MAX_BYTES=2000  # 合并消息的最大字节数 企业微信文本消息上限为2048字节
+    NOTIFY_QUEUE_LIMIT=1000  # 待发送消息数上限 超出时丢弃新消息
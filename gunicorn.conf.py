@@ -0,0 +1,21 @@
+import os
+from prometheus_client import multiprocess
+
+# gunicorn -c gunicorn.conf.py slips_data_svc:app
+# 只提供 HTTP 接口 自动化测试由 python3 slips_data_svc.py worker 进程执行
+bind = '0.0.0.0:5000'
+workers = int(os.environ.get('WEB_WORKERS', 4))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 4))
+timeout = 3600  # 上传和导入大文件的请求耗时较长
+graceful_timeout = 60
+
+def on_starting(server):  # 建表只在主进程做一次 避免多个 worker 同时建表
+    from slips_data_svc import app, db
+    with app.app_context():
+        db.create_all()
+        db.engine.dispose()  # 不把主进程的连接池带进 fork 出的 worker
+
+def child_exit(server, worker):  # 清理退出 worker 的实时指标文件
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(worker.pid)
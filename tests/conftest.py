@@ -0,0 +1,24 @@
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(scope='session')
+def svc():  # 与 bench/run_bench.py 一样在导入 slips_data_svc 之前把数据库和所有路径改到临时目录
+    import config
+    work_dir = tempfile.mkdtemp(prefix='slips-test-')
+    cfg = config.Config
+    cfg.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(work_dir, 'test.sqlite')
+    cfg.UPLOAD_FOLDER = os.path.join(work_dir, 'uploads')
+    cfg.STORAGE_PATH = os.path.join(work_dir, 'history')
+    cfg.EXECUTE_PATH = os.path.join(work_dir, 'data')
+    cfg.EXECUTE_SLOT_PATH = os.path.join(work_dir, 'data', '.slots')
+    cfg.BLOB_PATH = os.path.join(work_dir, 'blobs')
+    os.chdir(work_dir)  # app.log 写在临时目录
+    import slips_data_svc
+    with slips_data_svc.app.app_context():
+        slips_data_svc.db.create_all()
+    return slips_data_svc
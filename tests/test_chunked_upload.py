@@ -0,0 +1,47 @@
+import hashlib
+import os
+
+def put_chunk(client, upload_id, offset, data, checksum=None):
+    return client.put(f'/uploads/{upload_id}/chunks', query_string={'offset': offset}, data=data,
+                      headers={'X-Chunk-Sha256': checksum or hashlib.sha256(data).hexdigest()})
+
+def test_corrupted_retry_keeps_received_chunk(svc):
+    client = svc.app.test_client()
+    data = os.urandom(3000)
+    res = client.post('/uploads/d1_plan/merge', json={'filename': 'data.zip', 'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()})
+    assert res.status_code == 201
+    upload_id = res.get_json()['upload_id']
+    assert put_chunk(client, upload_id, 0, data[:1000]).status_code == 200
+    # 同一区间的损坏重传被拒绝 不能覆盖已收到的内容
+    assert put_chunk(client, upload_id, 0, b'x' * 1000, hashlib.sha256(data[:1000]).hexdigest()).status_code == 400
+    with open(os.path.join(svc.chunked_upload_dir(upload_id), 'data.zip'), 'rb') as f:
+        assert f.read(1000) == data[:1000]
+    assert client.get(f'/uploads/{upload_id}').get_json()['missing'] == [[1000, 3000]]
+
+def test_whole_file_mismatch_can_be_resent(svc):
+    client = svc.app.test_client()
+    data = os.urandom(2000)
+    res = client.post('/uploads/d1_plan/merge', json={'filename': 'data.zip', 'size': len(data), 'sha256': hashlib.sha256(data).hexdigest()})
+    upload_id = res.get_json()['upload_id']
+    # 各块自身校验通过 但与整体 sha256 不一致
+    assert put_chunk(client, upload_id, 0, b'y' * 2000).status_code == 200
+    res = client.post(f'/uploads/{upload_id}/finalize')
+    assert res.status_code == 409
+    status = client.get(f'/uploads/{upload_id}').get_json()
+    assert status['state'] == 'receiving' and status['missing'] == [[0, 2000]]
+    assert put_chunk(client, upload_id, 0, data).status_code == 200
+
+def test_chunk_after_finalize_started_is_rejected(svc, monkeypatch):
+    client = svc.app.test_client()
+    data = os.urandom(1000)
+    res = client.post('/uploads/d1_plan/merge', json={'filename': 'data.zip', 'size': len(data)})
+    upload_id = res.get_json()['upload_id']
+    assert put_chunk(client, upload_id, 0, data).status_code == 200
+    stale = svc.load_upload_meta(upload_id)
+    # 另一个请求在该块通过首次状态检查之后开始 finalize
+    with svc.upload_meta_lock(upload_id) as meta:
+        meta['state'] = 'finalizing'
+    monkeypatch.setattr(svc, 'load_upload_meta', lambda upload_id: stale)
+    assert put_chunk(client, upload_id, 0, b'z' * 1000).status_code == 409
+    with open(os.path.join(svc.chunked_upload_dir(upload_id), 'data.zip'), 'rb') as f:
+        assert f.read() == data
@@ -0,0 +1,42 @@
+import asyncio
+import fcntl
+import os
+import time
+
+def make_case(tmp_path):
+    case = tmp_path / 'case'
+    case.mkdir()
+    (case / 'algo_config.json').write_text('{}')
+    (case / 'store.hdf5').write_text('x')
+    return str(case)
+
+def test_gc_skips_slots_locked_by_other_processes(svc, tmp_path, monkeypatch):
+    monkeypatch.setitem(svc.app.config, 'EXECUTE_SLOT_RETENTION', 1)
+    case = make_case(tmp_path)
+    slots = []
+    for i in range(4):
+        slots.append(svc.stage_case_slot(case, 'd2_plan', 'gc', f'slot{i}'))
+        svc.release_slot(slots[-1])
+        os.utime(slots[-1], (time.time() + i, time.time() + i))
+    # 另一个 worker 进程预取的运行目录 独立打开的锁文件与其他进程的效果相同
+    with open(slots[0] + '.lock', 'a') as other:
+        fcntl.flock(other, fcntl.LOCK_SH)
+        svc.gc_execute_slots('d2_plan', 'gc')
+    assert [os.path.isdir(slot) for slot in slots] == [True, False, False, True]
+
+def test_exec_path_lock_waits_for_other_processes(svc, monkeypatch):
+    monkeypatch.setitem(svc.app.config, 'POLL_INTERVAL_MIN', 0.05)
+
+    async def acquire():
+        async with svc.exec_path_lock('d2_plan', 'lock'):
+            return time.monotonic()
+
+    os.makedirs(os.path.join(svc.app.config['EXECUTE_SLOT_PATH'], 'd2_plan'), exist_ok=True)
+    with open(os.path.join(svc.app.config['EXECUTE_SLOT_PATH'], 'd2_plan', 'lock.exec.lock'), 'a') as other:
+        fcntl.flock(other, fcntl.LOCK_EX)
+        released_at = time.monotonic() + 0.3
+        loop = asyncio.new_event_loop()
+        loop.call_later(0.3, other.close)
+        acquired_at = loop.run_until_complete(acquire())
+        loop.close()
+    assert acquired_at >= released_at - 0.05
@@ -0,0 +1,78 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+from make_hdf5 import make_store
+
+@pytest.fixture
+def count_reads(svc, monkeypatch):  # 统计每次导入从 HDF5 完整读取数据的遍数
+    reads = []
+    iter_hdf_chunks = svc.iter_hdf_chunks
+
+    def counted(store, key, chunk_size, start=0):
+        if start == 0:
+            reads.append(key)
+        return iter_hdf_chunks(store, key, chunk_size, start)
+
+    monkeypatch.setattr(svc, 'iter_hdf_chunks', counted)
+    return reads
+
+def test_changed_table_is_read_twice(svc, count_reads, tmp_path):
+    path = str(tmp_path / 'store.hdf5')
+    key = next(iter(make_store(path, tables=1, rows=2000, columns=6, seed=1)))
+    assert svc.import_key_file(path, key, 'changed_table')['action'] == 'full'
+    make_store(path, tables=1, rows=2000, columns=6, seed=2)
+    count_reads.clear()
+    result = svc.import_key_file(path, key, 'changed_table')
+    assert result['action'] == 'full' and result['rows'] == 2000
+    # 指纹和列统计同一遍 再写入一遍
+    assert count_reads == [key, key]
+
+def test_timedelta_column_is_written_as_nanoseconds(svc, tmp_path):
+    import pandas as pd
+    import sqlite3
+    path = str(tmp_path / 'timedelta.hdf5')
+    df = pd.DataFrame({'id': [1, 2], 'duration': pd.to_timedelta([1.5, None], unit='s')})
+    df.to_hdf(path, '/ods/db/test/durations', format='table')
+    assert svc.import_key_file(path, '/ods/db/test/durations', 'durations')['rows'] == 2
+    with sqlite3.connect(svc.app.config['SQLALCHEMY_DATABASE_URI'].removeprefix('sqlite:///')) as conn:
+        assert conn.execute('SELECT duration FROM durations ORDER BY id').fetchall() == [(1500000000,), (None,)]
+
+def test_appended_rows_must_fit_existing_column_types(svc):
+    from sqlalchemy.dialects import mysql
+    # 整秒 DATETIME 列会静默舍入小数秒 非严格模式下 VARCHAR 和整数溢出也不报错
+    assert not svc.column_fits(mysql.DATETIME(), {'fraction': True})
+    assert svc.column_fits(mysql.DATETIME(fsp=6), {'fraction': True})
+    assert not svc.column_fits(mysql.VARCHAR(8), {'length': 9})
+    assert svc.column_fits(mysql.VARCHAR(8), {'length': 8})
+    assert not svc.column_fits(mysql.TEXT(), {'length': 20000})
+    assert not svc.column_fits(mysql.TINYINT(unsigned=True), {'min': 0, 'max': 256})
+    assert not svc.column_fits(mysql.SMALLINT(unsigned=True), {'min': -1, 'max': 10})
+    assert svc.column_fits(mysql.SMALLINT(), {'min': -1, 'max': 10})
+
+def test_new_rows_are_appended(svc, tmp_path):
+    import pandas as pd
+    path = str(tmp_path / 'append.hdf5')
+    key = '/ods/db/test/appended'
+    pd.DataFrame({'id': range(10), 'code': ['a'] * 10}).to_hdf(path, key, format='table', min_itemsize={'code': 8})
+    assert svc.import_key_file(path, key, 'appended')['action'] == 'full'
+    pd.DataFrame({'id': range(10, 15), 'code': ['b'] * 5}).to_hdf(path, key, format='table', append=True)
+    result = svc.import_key_file(path, key, 'appended')
+    assert result['action'] == 'append' and result['rows'] == 5
+
+def test_columnar_cache_is_found_without_rehashing(svc, tmp_path, monkeypatch):
+    monkeypatch.setitem(svc.app.config, 'COLUMNAR_CACHE', True)
+    path = str(tmp_path / 'cached.hdf5')
+    make_store(path, tables=1, rows=100, columns=4)
+    digest = svc.file_sha256(path)
+    os.makedirs(os.path.dirname(svc.blob_path(digest)), exist_ok=True)
+    os.link(path, svc.blob_path(digest))  # 与上传时一样 用例文件是 blob 的硬链接
+    cache_dir = svc.build_columnar_cache(digest)
+
+    def rehash(file_path):
+        raise AssertionError('the whole file was hashed again')
+
+    monkeypatch.setattr(svc, 'file_sha256', rehash)
+    assert svc.find_columnar_cache(path) == cache_dir
+    assert svc.find_columnar_cache(svc.blob_path(digest)) == cache_dir
@@ -0,0 +1,55 @@
+import socket
+import threading
+import pytest
+import requests
+
+@pytest.fixture
+def dropping_server():  # 读完请求后不回复直接断开 模拟调度程序处理中崩溃
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(8)
+    requests_received = []
+
+    def serve():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            requests_received.append(conn.recv(65536))
+            conn.close()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield f'http://127.0.0.1:{server.getsockname()[1]}', requests_received
+    server.close()
+
+@pytest.fixture
+def fast_retries(svc, monkeypatch):
+    monkeypatch.setitem(svc.app.config, 'API_RETRIES', 2)
+    monkeypatch.setitem(svc.app.config, 'API_RETRY_BACKOFF', 0)
+
+def test_non_idempotent_call_is_not_resent_after_disconnect(svc, fast_retries, dropping_server, monkeypatch):
+    url, received = dropping_server
+    monkeypatch.setattr(svc, 'address', url)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        svc.interface_post('/jobPlan/newJobPlan', {})
+    assert len(received) == 1
+
+def test_idempotent_call_is_retried_after_disconnect(svc, fast_retries, dropping_server, monkeypatch):
+    url, received = dropping_server
+    monkeypatch.setattr(svc, 'address', url)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        svc.interface_post('/jobPlan/getScheduleStatus', {})
+    assert len(received) == 3
+
+def test_refused_connection_is_retried(svc, fast_retries, monkeypatch):
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()  # 端口上没有监听 连接被拒绝
+    calls = []
+    monkeypatch.setattr(svc, 'record_api_call', lambda url, seconds, ok: calls.append(ok))
+    monkeypatch.setattr(svc, 'address', f'http://127.0.0.1:{port}')
+    with pytest.raises(requests.exceptions.ConnectionError):
+        svc.interface_post('/jobPlan/newJobPlan', {})
+    assert calls == [False, False, False]
@@ -0,0 +1,14 @@
+def test_rate_limit_is_shared_between_dispatchers(svc):
+    # 两个副本的限速器共用 notify_rate 表 合计速率不超过配置值
+    first = svc.SharedRateLimiter('http://webhook/shared', rate=1, burst=2)
+    second = svc.SharedRateLimiter('http://webhook/shared', rate=1, burst=2)
+    waits = [limiter.take() for limiter in (first, second, first, second, first)]
+    assert waits[:2] == [0, 0]
+    assert [round(wait) for wait in waits[2:]] == [1, 2, 3]
+
+def test_drain_delays_every_dispatcher(svc):
+    first = svc.SharedRateLimiter('http://webhook/drain', rate=1, burst=3)
+    second = svc.SharedRateLimiter('http://webhook/drain', rate=1, burst=3)
+    assert first.take() == 0
+    first.drain()
+    assert round(second.take()) == 1
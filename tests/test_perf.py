@@ -0,0 +1,15 @@
+import os
+
+def test_dataset_hash_changes_with_algo_config(svc):
+    case = os.path.join(svc.app.config['STORAGE_PATH'], 'd2_plan', 'perf', 'case_0')
+    os.makedirs(case, exist_ok=True)
+    with open(os.path.join(case, 'store.hdf5'), 'wb') as f:
+        f.write(b'data')
+    with open(os.path.join(case, 'algo_config.json'), 'w') as f:
+        f.write('{"iterations": 1}')
+    before = svc.dataset_hash('d2_plan', 'perf', 'case_0')
+    # 新内容写入新文件 与上传时一样不原地修改
+    os.remove(os.path.join(case, 'algo_config.json'))
+    with open(os.path.join(case, 'algo_config.json'), 'w') as f:
+        f.write('{"iterations": 2}')
+    assert svc.dataset_hash('d2_plan', 'perf', 'case_0') != before
@@ -0,0 +1,39 @@
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+def test_run_stops_when_lease_cannot_be_renewed(svc, monkeypatch):
+    # 数据库不可用时 租约到期前停止本地运行 之后才可能被其他 worker 接管
+    monkeypatch.setitem(svc.app.config, 'RUN_LEASE_SECONDS', 0.6)
+
+    def unreachable(run_id):
+        raise ConnectionError('database unreachable')
+
+    monkeypatch.setattr(svc, 'renew_lease', unreachable)
+
+    async def run():
+        claimed_at = time.monotonic()
+        task = asyncio.ensure_future(asyncio.sleep(10))
+        await svc.keep_lease(1, task, claimed_at)
+        await asyncio.gather(task, return_exceptions=True)
+        return task.cancelled(), time.monotonic() - claimed_at
+
+    cancelled, seconds = asyncio.run(run())
+    assert cancelled and seconds < 0.6
+
+def test_lease_uses_database_clock(svc, monkeypatch):
+    # 本地时钟快了一小时的副本不会提前接管其他 worker 的运行
+    run_id, _ = svc.enqueue_run('t1_plan', 'push', 'clock:1')
+    assert svc.claim_run('t1_plan') == run_id
+
+    class SkewedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(hours=1)
+
+    monkeypatch.setattr(svc, 'datetime', SkewedDatetime)
+    monkeypatch.setattr(svc, 'WORKER_ID', 'other-worker')
+    assert svc.claim_run('t1_plan') is None
+    with svc.app.app_context():
+        run = svc.db.session.get(svc.AutoTestRun, run_id)
+        assert run.state == 'running' and run.lease_owner != 'other-worker'
@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+def test_idle_result_counts_when_busy_query_is_slower_than_ttl(svc, monkeypatch):
+    # 查询耗时超过 WATCH_TTL 时 空闲结果从返回时起算有效期 等待者仍能被放行
+    monkeypatch.setitem(svc.app.config, 'WATCH_TTL', 0.2)
+    monkeypatch.setitem(svc.app.config, 'WATCH_INTERVAL', 0.05)
+    calls = []
+
+    def slow_is_plan_scheduling(plan_type, station):
+        calls.append(station)
+        time.sleep(0.3)
+        return False
+
+    monkeypatch.setattr(svc, 'is_plan_scheduling', slow_is_plan_scheduling)
+
+    async def acquire_twice():
+        watcher = svc.SchedulerWatcher('jobPlan', 'D1')
+        await asyncio.wait_for(watcher.acquire(), 5)
+        watcher.release()
+        # 放行后需要一次在 release 之后发出的查询
+        await asyncio.wait_for(watcher.acquire(), 5)
+        watcher.release()
+
+    asyncio.run(acquire_twice())
+    assert len(calls) >= 2
+
+def test_busy_result_blocks(svc, monkeypatch):
+    monkeypatch.setitem(svc.app.config, 'WATCH_INTERVAL', 0.05)
+    monkeypatch.setattr(svc, 'is_plan_scheduling', lambda plan_type, station: True)
+
+    async def acquire():
+        watcher = svc.SchedulerWatcher('jobPlan', 'D1')
+        await asyncio.wait_for(watcher.acquire(), 0.5)
+
+    try:
+        asyncio.run(acquire())
+    except asyncio.TimeoutError:
+        return
+    raise AssertionError('acquired while the scheduler was busy')
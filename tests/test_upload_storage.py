@@ -0,0 +1,21 @@
+import os
+
+def test_replace_dir_swaps_without_moving_target_away(svc, tmp_path, monkeypatch):
+    # 先把旧目录改名移开再改名新目录时 两次改名之间测试数据目录不存在 运行会报没有测试数据
+    dst = str(tmp_path / 'merge')
+    src = str(tmp_path / '.merge-upload')
+    os.makedirs(os.path.join(dst, 'old_case'))
+    os.makedirs(os.path.join(src, 'new_case'))
+    moved_away = []
+    rename = os.rename
+
+    def record_rename(a, b):
+        if a == dst:
+            moved_away.append(b)
+        rename(a, b)
+
+    monkeypatch.setattr(os, 'rename', record_rename)
+    svc.replace_dir(src, dst)
+    assert os.listdir(dst) == ['new_case']
+    assert not os.path.exists(src)
+    assert not moved_away
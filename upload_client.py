@@ -0,0 +1,95 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+# 分块断点续传上传客户端 中断后用相同参数重新运行即可从缺失的块继续
+# 用法: python3 upload_client.py http://<host>:5000 d1_plan merge data.zip [--workers 4]
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for buf in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(buf)
+    return hasher.hexdigest()
+
+def request_with_retry(session, method, url, retries, **kwargs):  # 连接错误和5xx时退避重试
+    for attempt in range(retries + 1):
+        try:
+            res = session.request(method, url, timeout=(10, 600), **kwargs)
+            if res.status_code < 500:
+                return res
+            error = f'HTTP {res.status_code}: {res.text[:200]}'
+        except requests.exceptions.RequestException as e:
+            error = repr(e)
+        if attempt < retries:
+            print(f'{method} {url} failed ({error}), retrying')
+            time.sleep(min(2 ** attempt, 60))
+    raise RuntimeError(f'{method} {url} failed: {error}')
+
+def put_chunk(session, base_url, upload_id, path, start, end, retries):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    headers = {'X-Chunk-Sha256': hashlib.sha256(data).hexdigest(), 'Content-Type': 'application/octet-stream'}
+    for attempt in range(retries + 1):
+        res = request_with_retry(session, 'PUT', f'{base_url}/uploads/{upload_id}/chunks', retries, params={'offset': start}, data=data, headers=headers)
+        if res.status_code == 200:
+            return end - start
+        if res.status_code != 400 or attempt == retries:
+            raise RuntimeError(f'Chunk at {start} rejected: {res.text[:200]}')
+        print(f'Chunk at {start} rejected ({res.text[:200]}), resending')
+
+def upload(base_url, upload_type, stage, path, workers=4, retries=5):
+    base_url = base_url.rstrip('/')
+    session = requests.Session()
+    size = os.path.getsize(path)
+    state_path = path + '.upload.json'  # 记录上传 ID 重新运行时续传
+    state = json.load(open(state_path)) if os.path.exists(state_path) else {}
+    status = None
+    if state.get('upload_id') and state.get('size') == size and state.get('mtime') == os.path.getmtime(path):
+        res = request_with_retry(session, 'GET', f"{base_url}/uploads/{state['upload_id']}", retries)
+        if res.status_code == 200 and res.json()['state'] == 'receiving':
+            status = res.json()
+            print(f"Resuming upload {status['upload_id']}, {status['received_bytes']}/{size} bytes already received")
+    if status is None:
+        print(f'Computing sha256 of {path}')
+        res = request_with_retry(session, 'POST', f'{base_url}/uploads/{upload_type}/{stage}', retries,
+                                 json={'filename': os.path.basename(path), 'size': size, 'sha256': file_sha256(path)})
+        if res.status_code != 201:
+            raise RuntimeError(f'Init failed: {res.text[:200]}')
+        status = res.json()
+        with open(state_path, 'w') as f:
+            json.dump({'upload_id': status['upload_id'], 'size': size, 'mtime': os.path.getmtime(path)}, f)
+    upload_id = status['upload_id']
+    chunk_size = status['chunk_size']
+    chunks = [(start, min(start + chunk_size, end)) for range_start, end in status['missing'] for start in range(range_start, end, chunk_size)]
+    sent = status['received_bytes']
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for n in executor.map(lambda chunk: put_chunk(session, base_url, upload_id, path, chunk[0], chunk[1], retries), chunks):
+            sent += n
+            print(f'{sent}/{size} bytes ({sent * 100 / size:.1f}%)')
+    res = request_with_retry(session, 'POST', f'{base_url}/uploads/{upload_id}/finalize', retries)
+    if res.status_code != 200:
+        raise RuntimeError(f'Finalize failed: {res.text[:500]}')
+    os.remove(state_path)
+    print(res.json()['status'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Resumable upload of a data set zip')
+    parser.add_argument('base_url')
+    parser.add_argument('upload_type')
+    parser.add_argument('stage')
+    parser.add_argument('path')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--retries', type=int, default=5)
+    args = parser.parse_args()
+    try:
+        upload(args.base_url, args.upload_type, args.stage, args.path, args.workers, args.retries)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)